@@ -6,7 +6,8 @@ Target:
   SAP-samples/btp-service-metadata (main) /v1/developer
 
 Output:
-  - Writes ./catalog.json (debug/trace)
+  - Writes ./catalog.json (debug/trace; compact, use --pretty for indented)
+  - Writes ./catalog.ndjson (one service entry per line, for streaming consumers)
   - Prints JSON to stdout in the shape: {"text": "<CATALOG_AS_STRING>"}
 
 Change requested:
@@ -18,12 +19,14 @@ Optional:
   export GITHUB_TOKEN=...  (higher rate limit)
 
 Run:
-  pip install requests
-  python crawl_small_catalog.py
+  pip install requests aiohttp orjson msgspec
+  python crawl_small_catalog.py [--pretty]
 """
 
 from __future__ import annotations
 
+import argparse
+import asyncio
 import json
 import os
 import sys
@@ -31,7 +34,12 @@ import time
 from pathlib import Path
 from typing import Any, Dict, List, Optional, Tuple
 
+import aiohttp
+import msgspec
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 OWNER = "SAP-samples"
 REPO = "btp-service-metadata"
@@ -39,15 +47,36 @@ BRANCH = "main"
 START_PATH = "v1/developer"
 
 OUT_FILE = Path("catalog.json")
+NDJSON_FILE = Path("catalog.ndjson")
+TREE_CACHE_FILE = Path(".cache/tree.json")
+
+# pick_best_link(): lower rank wins, any other classification ranks 2
+LINK_RANK = {"discovery center": 0, "documentation": 1}
 
 GITHUB_API = "https://api.github.com"
+GRAPHQL_URL = f"{GITHUB_API}/graphql"
+GRAPHQL_BATCH_SIZE = 100
+USER_AGENT = "btp-metadata-small-catalog/1.0"
+DOWNLOAD_CONCURRENCY = 50
+MAX_BLOB_API_BYTES = 1_000_000
 SESSION = requests.Session()
+SESSION.mount(GITHUB_API, HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=64,
+    max_retries=Retry(
+        total=5,
+        backoff_factor=0.5,
+        status_forcelist=[502, 503, 504],
+        respect_retry_after_header=True,
+        raise_on_status=False,  # hand the last response to raise_for_status()
+    ),
+))
 
 
 def gh_headers() -> Dict[str, str]:
     h = {
         "Accept": "application/vnd.github+json",
-        "User-Agent": "btp-metadata-small-catalog/1.0",
+        "User-Agent": USER_AGENT,
     }
     token = os.getenv("GITHUB_TOKEN")
     if token:
@@ -55,8 +84,12 @@ def gh_headers() -> Dict[str, str]:
     return h
 
 
-def api_get(url: str, params: Optional[dict] = None) -> requests.Response:
-    resp = SESSION.get(url, headers=gh_headers(), params=params, timeout=30)
+SESSION.headers.update(gh_headers())
+
+
+def api_get(url: str, params: Optional[dict] = None, headers: Optional[dict] = None) -> requests.Response:
+    # NOTE: 304 Not Modified (conditional requests) passes raise_for_status()
+    resp = SESSION.get(url, params=params, headers=headers, timeout=30)
 
     # Simple rate limit handling
     if resp.status_code == 403 and resp.headers.get("X-RateLimit-Remaining") == "0":
@@ -64,7 +97,7 @@ def api_get(url: str, params: Optional[dict] = None) -> requests.Response:
         sleep_for = max(1, reset_ts - int(time.time()) + 2)
         print(f"[rate-limit] sleeping {sleep_for}s ...", file=sys.stderr)
         time.sleep(sleep_for)
-        resp = SESSION.get(url, headers=gh_headers(), params=params, timeout=30)
+        resp = SESSION.get(url, params=params, headers=headers, timeout=30)
 
     resp.raise_for_status()
     return resp
@@ -109,36 +142,136 @@ def crawl_file_items(start_path: str) -> List[Dict[str, Any]]:
     return files
 
 
-def download_text(url: str) -> str:
-    # raw URLs are public; keep UA header only
-    resp = SESSION.get(url, headers={"User-Agent": "btp-metadata-small-catalog/1.0"}, timeout=60)
-    resp.raise_for_status()
-    return resp.text
+def load_tree_cache() -> Dict[str, Any]:
+    try:
+        return orjson.loads(TREE_CACHE_FILE.read_bytes())
+    except (OSError, ValueError):
+        return {}
+
+
+def save_tree_cache(cache: Dict[str, Any]) -> None:
+    TREE_CACHE_FILE.parent.mkdir(parents=True, exist_ok=True)
+    TREE_CACHE_FILE.write_bytes(orjson.dumps(cache))
+
+
+def list_tree_files(ref: str) -> Optional[List[Dict[str, Any]]]:
+    """
+    List all files below START_PATH with ONE recursive Git Trees API call.
+    `ref` may be a commit sha or a branch name.
+    Items mimic the Contents API shape (path, sha, size, download_url, html_url).
+    Returns None if GitHub truncated the tree (caller falls back to crawling).
+    """
+    url = f"{GITHUB_API}/repos/{OWNER}/{REPO}/git/trees/{ref}"
+
+    # Conditional request: 304 does not count against the rate limit
+    cached = load_tree_cache()
+    headers = None
+    if cached.get("url") == url and cached.get("etag"):
+        headers = {"If-None-Match": cached["etag"]}
+
+    resp = api_get(url, params={"recursive": "1"}, headers=headers)
+    if resp.status_code == 304:
+        print("[cache] tree listing not modified", file=sys.stderr)
+        data = cached["tree"]
+    else:
+        data = resp.json()
+        if resp.headers.get("ETag"):
+            save_tree_cache({"url": url, "etag": resp.headers["ETag"], "tree": data})
+
+    if data.get("truncated"):
+        return None
+
+    prefix = START_PATH + "/"
+    files: List[Dict[str, Any]] = []
+    for item in data.get("tree", []):
+        path = item.get("path", "")
+        if item.get("type") != "blob" or not path.startswith(prefix):
+            continue
+        files.append({
+            "path": path,
+            "sha": item.get("sha"),
+            "size": item.get("size"),
+            "download_url": f"https://raw.githubusercontent.com/{OWNER}/{REPO}/{BRANCH}/{path}",
+            "html_url": f"https://github.com/{OWNER}/{REPO}/blob/{BRANCH}/{path}",
+        })
+
+    return files
+
+
+class Link(msgspec.Struct):
+    classification: Optional[str] = None
+    value: Optional[str] = None
+
+
+class ServicePlan(msgspec.Struct):
+    deprecated: Optional[bool] = None
+    deprecationMessage: Optional[str] = None
+    deprecationDate: Optional[str] = None
+
+
+class Service(msgspec.Struct):
+    """
+    The part of a service document the catalog uses (unknown keys are ignored).
+    Documents that do not match these types fall back to the generic dict helpers.
+    """
+    name: Optional[str] = None
+    description: Optional[str] = None
+    links: Optional[List[Link]] = None
+    servicePlans: Optional[List[ServicePlan]] = None
+    deprecated: Optional[bool] = None
+    isDeprecated: Optional[bool] = None
+
+
+SERVICE_DECODER = msgspec.json.Decoder(Service)
+
+
+def service_link(service: Service, fallback_html_url: str) -> str:
+    """
+    Typed twin of pick_best_link().
+    """
+    best_rank = 3
+    best_value: Optional[str] = None
+    for l in service.links or ():
+        if not l.value:
+            continue
+        rank = LINK_RANK.get((l.classification or "").lower(), 2)
+        if rank < best_rank:
+            best_rank, best_value = rank, l.value
+            if rank == 0:
+                break
+    return best_value if best_value is not None else fallback_html_url
+
+
+def service_deprecated(service: Service) -> bool:
+    """
+    Typed twin of aggregate_deprecation(), deprecated flag only.
+    """
+    if service.deprecated or service.isDeprecated:
+        return True
+    return any(p.deprecated for p in service.servicePlans or ())
 
 
 def pick_best_link(service_obj: Dict[str, Any], fallback_html_url: str) -> str:
     """
-    Prefer Discovery Center link, then Documentation, else fallback html_url.
+    Prefer Discovery Center link, then Documentation, then anything with a value,
+    else fallback html_url. Single pass: keep the best-ranked link seen so far.
     """
     links = service_obj.get("links") or []
+    best_rank = 3
+    best_value: Any = None
     if isinstance(links, list):
-        # 1) Discovery Center
         for l in links:
             if not isinstance(l, dict):
                 continue
-            if (l.get("classification") or "").lower() == "discovery center" and l.get("value"):
-                return str(l["value"])
-        # 2) Documentation
-        for l in links:
-            if not isinstance(l, dict):
+            value = l.get("value")
+            if not value:
                 continue
-            if (l.get("classification") or "").lower() == "documentation" and l.get("value"):
-                return str(l["value"])
-        # 3) Anything with value
-        for l in links:
-            if isinstance(l, dict) and l.get("value"):
-                return str(l["value"])
-    return fallback_html_url
+            rank = LINK_RANK.get((l.get("classification") or "").lower(), 2)
+            if rank < best_rank:
+                best_rank, best_value = rank, value
+                if rank == 0:
+                    break
+    return str(best_value) if best_rank < 3 else fallback_html_url
 
 
 def aggregate_deprecation(service_obj: Dict[str, Any]) -> Tuple[bool, Optional[str], Optional[str]]:
@@ -154,7 +287,7 @@ def aggregate_deprecation(service_obj: Dict[str, Any]) -> Tuple[bool, Optional[s
 
     # Root-level (rare)
     for k in ("deprecated", "isDeprecated"):
-        if isinstance(service_obj.get(k), bool) and service_obj.get(k):
+        if service_obj.get(k) is True:
             deprecated = True
 
     for k in ("deprecationMessage", "deprecatedMessage"):
@@ -171,79 +304,268 @@ def aggregate_deprecation(service_obj: Dict[str, Any]) -> Tuple[bool, Optional[s
     plans = service_obj.get("servicePlans") or []
     if isinstance(plans, list):
         for p in plans:
-            if not isinstance(p, dict):
+            if not isinstance(p, dict) or p.get("deprecated") is not True:
                 continue
-            if p.get("deprecated") is True:
-                deprecated = True
-                if not msg and isinstance(p.get("deprecationMessage"), str) and p["deprecationMessage"].strip():
-                    msg = p["deprecationMessage"].strip()
-                if not date and isinstance(p.get("deprecationDate"), str) and p["deprecationDate"].strip():
-                    date = p["deprecationDate"].strip()
+            deprecated = True
+            if not msg:
+                v = p.get("deprecationMessage")
+                if isinstance(v, str) and v.strip():
+                    msg = v.strip()
+            if not date:
+                v = p.get("deprecationDate")
+                if isinstance(v, str) and v.strip():
+                    date = v.strip()
+            if msg and date:
+                break
 
     return deprecated, msg, date
 
 
-def main() -> None:
-    head_sha = get_branch_head_sha()
+def build_entry(content: bytes, path: str, sha: Optional[str], raw_url: str, html_url: str) -> Dict[str, Any]:
+    """
+    Transform one service JSON document into its catalog entry.
+    Pure function: no network, no shared state.
+    """
+    try:
+        # Schema-directed decode straight from bytes
+        service = SERVICE_DECODER.decode(content)
+        name = service.name
+        description = service.description
+        link = service_link(service, html_url)
+        deprecated = service_deprecated(service)
+    except msgspec.ValidationError:
+        # Off-schema document (unexpected field types): generic best-effort navigation
+        service_obj = orjson.loads(content)
+        name = service_obj.get("name")
+        description = service_obj.get("description")
+        link = pick_best_link(service_obj, html_url)
+        deprecated, _deprecation_message, _deprecation_date = aggregate_deprecation(service_obj)
+
+    # Minimal fields
+    name = name or path.rsplit("/", 1)[-1].rsplit(".", 1)[0]
+
+    # Pack required fields into ONE string field "metadata"
+    metadata_obj = {
+        "name": name,
+        "description": description,
+        "deprecated": deprecated,
+        "link": link,
+    }
+    metadata_str = json.dumps(metadata_obj, ensure_ascii=False)
+
+    return {
+        "metadata": metadata_str,
+        # traceability (kept separate; remove if you truly want ONLY metadata)
+        "path": path,
+        "sha": sha,
+        "raw_url": raw_url,
+        "html_url": html_url,
+    }
+
+
+async def fetch_blob_texts(
+    files: List[Dict[str, Any]],
+    session: aiohttp.ClientSession,
+    sem: asyncio.Semaphore,
+) -> Dict[str, bytes]:
+    """
+    Fetch blob contents via the GraphQL API, GRAPHQL_BATCH_SIZE blobs per request
+    (aliased `object(oid:)` lookups), instead of one request per file.
+    Returns {sha: content}. Binary, truncated or oversized blobs and failed
+    batches are left out; callers download those from the raw URL.
+    """
+    shas = list(dict.fromkeys(
+        f["sha"] for f in files
+        if f.get("sha") and (f.get("size") or 0) <= MAX_BLOB_API_BYTES
+    ))
+
+    async def fetch_batch(batch: List[str]) -> Dict[str, bytes]:
+        fields = " ".join(
+            f'b{i}: object(oid: "{sha}") {{ ... on Blob {{ isBinary isTruncated text }} }}'
+            for i, sha in enumerate(batch)
+        )
+        query = f'query {{ repository(owner: "{OWNER}", name: "{REPO}") {{ {fields} }} }}'
+        async with sem, session.post(GRAPHQL_URL, json={"query": query}, headers=gh_headers()) as resp:
+            resp.raise_for_status()
+            data = orjson.loads(await resp.read())
+
+        repo = (data.get("data") or {}).get("repository") or {}
+        texts: Dict[str, bytes] = {}
+        for i, sha in enumerate(batch):
+            blob = repo.get(f"b{i}")
+            if blob and not blob.get("isBinary") and not blob.get("isTruncated") and blob.get("text") is not None:
+                texts[sha] = blob["text"].encode("utf-8")
+        return texts
+
+    results = await asyncio.gather(
+        *(fetch_batch(shas[i:i + GRAPHQL_BATCH_SIZE]) for i in range(0, len(shas), GRAPHQL_BATCH_SIZE)),
+        return_exceptions=True,
+    )
+
+    texts: Dict[str, bytes] = {}
+    for res in results:
+        if isinstance(res, Exception):
+            print(f"[graphql] batch failed, falling back to raw downloads: {res}", file=sys.stderr)
+        else:
+            texts.update(res)
+    return texts
+
+
+async def download_raw(url: str, session: aiohttp.ClientSession, sem: asyncio.Semaphore) -> bytes:
+    async with sem, session.get(url) as resp:
+        resp.raise_for_status()
+        return await resp.read()
+
+
+async def fetch_content(
+    f: Dict[str, Any],
+    session: aiohttp.ClientSession,
+    sem: asyncio.Semaphore,
+    texts: Dict[str, bytes],
+    downloads: Dict[str, "asyncio.Task[bytes]"],
+) -> bytes:
+    """
+    File content as raw bytes (no text decoding; orjson parses bytes).
+    Uses the prefetched GraphQL text if available, else downloads the raw file.
+    Files sharing a blob sha share one download task.
+    """
+    sha = f.get("sha")
+    content = texts.get(sha)
+    if content is not None:
+        return content
+
+    key = sha or f["download_url"]
+    task = downloads.get(key)
+    if task is None:
+        task = downloads[key] = asyncio.ensure_future(download_raw(f["download_url"], session, sem))
+    return await task
+
+
+def is_unchanged(f: Dict[str, Any], prev: Dict[str, Dict[str, Any]]) -> bool:
+    cached = prev.get(f.get("path", ""))
+    return cached is not None and cached["sha"] == f.get("sha")
+
+
+def load_previous_entries() -> Dict[str, Dict[str, Any]]:
+    """
+    Entries of the last written catalog, keyed by path.
+    Blob shas are content-addressed, so a matching sha means identical content.
+    """
+    if not OUT_FILE.exists():
+        return {}
+    try:
+        services = orjson.loads(OUT_FILE.read_bytes()).get("services", [])
+    except Exception as e:
+        print(f"[cache] ignoring previous {OUT_FILE}: {e}", file=sys.stderr)
+        return {}
+    return {e["path"]: e for e in services if isinstance(e, dict) and e.get("path") and e.get("sha")}
+
+
+async def process(
+    f: Dict[str, Any],
+    session: aiohttp.ClientSession,
+    sem: asyncio.Semaphore,
+    prev: Dict[str, Dict[str, Any]],
+    texts: Dict[str, bytes],
+    downloads: Dict[str, "asyncio.Task[bytes]"],
+) -> Dict[str, Any]:
+    """
+    Fetch one service file and build its catalog entry.
+    Unchanged files (same sha and path as in the previous catalog) are reused as-is.
+    """
+    path = f["path"]
+    raw_url = f["download_url"]
+    html_url = f["html_url"]
+    sha = f.get("sha")
+
+    if is_unchanged(f, prev):
+        return prev[path]
+
+    content = await fetch_content(f, session, sem, texts, downloads)
+    return build_entry(content, path, sha, raw_url, html_url)
+
+
+async def process_all(files: List[Dict[str, Any]], prev: Dict[str, Dict[str, Any]]) -> List[Any]:
+    """
+    Fetch + process all files concurrently (bounded by DOWNLOAD_CONCURRENCY).
+    Result order matches `files`; failures are returned as exceptions.
+    """
+    done = 0
+
+    async def tracked(f: Dict[str, Any]) -> Dict[str, Any]:
+        nonlocal done
+        try:
+            return await process(f, session, sem, prev, texts, downloads)
+        finally:
+            done += 1
+            if done % 50 == 0:
+                print(f"[progress] {done}/{len(files)}", file=sys.stderr)
+
+    # raw URLs are public; keep UA header only
+    async with aiohttp.ClientSession(
+        headers={"User-Agent": USER_AGENT},
+        connector=aiohttp.TCPConnector(limit=DOWNLOAD_CONCURRENCY),
+        timeout=aiohttp.ClientTimeout(total=60),
+    ) as session:
+        sem = asyncio.Semaphore(DOWNLOAD_CONCURRENCY)
+
+        # GraphQL needs a token; anonymous runs download raw files only
+        texts: Dict[str, bytes] = {}
+        if os.getenv("GITHUB_TOKEN"):
+            todo = [f for f in files if not is_unchanged(f, prev)]
+            texts = await fetch_blob_texts(todo, session, sem)
+
+        downloads: Dict[str, "asyncio.Task[bytes]"] = {}
+
+        return await asyncio.gather(*(tracked(f) for f in files), return_exceptions=True)
+
+
+async def list_head_and_tree() -> Tuple[Optional[str], Optional[List[Dict[str, Any]]]]:
+    """
+    Resolve the branch head sha and list the tree by branch name in parallel;
+    neither request depends on the other.
+    """
+    head_sha, files = await asyncio.gather(
+        asyncio.to_thread(get_branch_head_sha),
+        asyncio.to_thread(list_tree_files, BRANCH),
+    )
+    return head_sha, files
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=f"Build {OUT_FILE} from {OWNER}/{REPO}:{START_PATH}")
+    parser.add_argument("--pretty", action="store_true", help=f"write {OUT_FILE} indented (default: compact)")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    prev = load_previous_entries()
+    if prev:
+        print(f"[cache] {len(prev)} entries from previous {OUT_FILE}", file=sys.stderr)
 
     print(f"[crawl] {OWNER}/{REPO}@{BRANCH}:{START_PATH}", file=sys.stderr)
-    files = crawl_file_items(START_PATH)
+    head_sha, files = asyncio.run(list_head_and_tree())
+    if files is None:
+        # Truncated tree: walk directories via Contents API
+        files = crawl_file_items(START_PATH)
     print(f"[found] {len(files)} files", file=sys.stderr)
 
-    entries: List[Dict[str, Any]] = []
-    errors = 0
+    # Only process JSON files (developer folder seems to be json); filter before any download
+    files = [f for f in files if f.get("path", "").endswith(".json") and f.get("download_url") and f.get("html_url")]
+    print(f"[found] {len(files)} service JSON files", file=sys.stderr)
 
-    for i, f in enumerate(files, start=1):
-        path = f.get("path", "")
-        raw_url = f.get("download_url")
-        html_url = f.get("html_url")
-        sha = f.get("sha")
+    results = asyncio.run(process_all(files, prev))
 
-        # Only process JSON files (developer folder seems to be json)
-        if not path.endswith(".json"):
-            continue
-        if not raw_url or not html_url:
-            continue
+    entries: List[Dict[str, Any]] = []
+    errors = 0
 
-        try:
-            content = download_text(raw_url)
-            service_obj = json.loads(content)
-
-            # Minimal fields
-            name = service_obj.get("name") or Path(path).stem
-            description = service_obj.get("description")
-
-            # Build "service link"
-            link = pick_best_link(service_obj, html_url)
-
-            # Deprecation (bool)
-            deprecated, _deprecation_message, _deprecation_date = aggregate_deprecation(service_obj)
-
-            # Pack required fields into ONE string field "metadata"
-            metadata_obj = {
-                "name": name,
-                "description": description,
-                "deprecated": deprecated,
-                "link": link,
-            }
-            metadata_str = json.dumps(metadata_obj, ensure_ascii=False)
-
-            entry: Dict[str, Any] = {
-                "metadata": metadata_str,
-                # traceability (kept separate; remove if you truly want ONLY metadata)
-                "path": path,
-                "sha": sha,
-                "raw_url": raw_url,
-                "html_url": html_url,
-            }
-            entries.append(entry)
-
-        except Exception as e:
+    for f, res in zip(files, results):
+        if isinstance(res, Exception):
             errors += 1
-            print(f"[error] {path}: {e}", file=sys.stderr)
-
-        if i % 50 == 0:
-            print(f"[progress] {i}/{len(files)}", file=sys.stderr)
+            print(f"[error] {f.get('path', '')}: {res}", file=sys.stderr)
+        else:
+            entries.append(res)
 
     catalog = {
         "generated_at_utc": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
@@ -260,7 +582,12 @@ def main() -> None:
     }
 
     # Optional: keep writing a file for debugging/traceability
-    OUT_FILE.write_text(json.dumps(catalog, ensure_ascii=False, indent=2), encoding="utf-8")
+    OUT_FILE.write_bytes(orjson.dumps(catalog, option=orjson.OPT_INDENT_2 if args.pretty else None))
+
+    # Sidecar for streaming consumers: same entries, one JSON object per line
+    with NDJSON_FILE.open("wb") as fh:
+        for entry in entries:
+            fh.write(orjson.dumps(entry, option=orjson.OPT_APPEND_NEWLINE))
 
     # REQUIRED: return property "text" as a STRING
     payload = {
@@ -270,7 +597,7 @@ def main() -> None:
     }
 
     print(json.dumps(payload, ensure_ascii=False))
-    print(f"[done] wrote {OUT_FILE} with {len(entries)} services (errors: {errors})", file=sys.stderr)
+    print(f"[done] wrote {OUT_FILE} and {NDJSON_FILE} with {len(entries)} services (errors: {errors})", file=sys.stderr)
 
 
 if __name__ == "__main__":